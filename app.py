@@ -1,6 +1,11 @@
+import collections
+import datetime
 import os
 import queue
+import re
 import threading
+import tkinter
+import traceback
 from typing import Callable
 
 import customtkinter
@@ -19,10 +24,31 @@ class ControledEntry(customtkinter.CTkEntry):
         **kwargs: Additional keyword arguments for the CTkEntry widget.
     """
 
+    # Tcl command names of registered control functions, keyed by (toplevel window, function)
+    registered_commands = {}
+
     def __init__(self, master, control_function: Callable[[str], bool], **kwargs):
         super().__init__(master, **kwargs)
         self.configure(validate="key")
-        self.configure(validatecommand=(self.register(control_function), "%P"))
+        self.configure(validatecommand=(self.get_command(control_function), "%P"))
+
+    def get_command(self, control_function: Callable[[str], bool]) -> str:
+        """Returns the Tcl command name for the control function.
+        The function is registered once per toplevel window and reused by every entry in it.
+
+        Args:
+            control_function (Callable[[str], bool]): The function that controls input.
+        """
+
+        toplevel = self.winfo_toplevel()
+        key = (toplevel, control_function)
+        if key not in self.registered_commands:
+            self.registered_commands[key] = toplevel.register(control_function)
+        return self.registered_commands[key]
+
+
+# Empty string or an integer from 1 to 999 without leading zeros
+FOV_ENTRY_PATTERN = re.compile(r"(|[1-9]\d{0,2})")
 
 
 def validate_fov_entry(string: str) -> bool:
@@ -31,17 +57,9 @@ def validate_fov_entry(string: str) -> bool:
     Args:
         string (str): The string to check
     """
-    if string == "":
-        return True
-    try:
-        int_value = int(string)
-        if int_value < 1:
-            return False
-        if int_value > 360:
-            return False
-    except:
+    if FOV_ENTRY_PATTERN.fullmatch(string) is None:
         return False
-    return True
+    return string == "" or int(string) <= 360
 
 
 class NewConversionTab(customtkinter.CTkFrame):
@@ -49,70 +67,82 @@ class NewConversionTab(customtkinter.CTkFrame):
     Tab view for collecting input values for a new conversion. Validates input and starts the conversion process.
     """
 
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, app, **kwargs):
         super().__init__(master, **kwargs)
 
-        # Initializing the converter
-        self.converter = Converter(lambda x: print(x))
+        # Using the application and its shared converter
+        self.app = app
+        self.converter = app.converter
 
         # Initializing conversion parameters
         self.input_video_path_var = customtkinter.StringVar()
         self.output_directory_path_var = customtkinter.StringVar()
         self.fov_var = customtkinter.StringVar()
         self.fov_var.set(190)
+        self.resumable_var = customtkinter.BooleanVar(value=True)
 
-        # Video file selection
-        self.input_video_frame = customtkinter.CTkFrame(master=self)
-        self.input_video_frame.pack(fill="x", expand=1, padx=10, pady=10)
+        # Widgets are placed directly on the tab in a grid, second column takes the free space
+        self.grid_columnconfigure(1, weight=1)
 
+        # Video file selection
         self.input_video_button = customtkinter.CTkButton(
-            master=self.input_video_frame,
+            master=self,
             text="Select input video",
             command=self.select_input_video,
         )
-        self.input_video_button.pack(padx=10, pady=10, fill="x")
-        self.input_video_label = customtkinter.CTkLabel(
-            master=self.input_video_frame, text="Selected:"
+        self.input_video_button.grid(
+            row=0, column=0, columnspan=2, sticky="ew", padx=10, pady=(10, 0)
+        )
+        self.input_video_label = customtkinter.CTkLabel(master=self, text="Selected:")
+        self.input_video_label.grid(
+            row=1, column=0, columnspan=2, sticky="w", padx=10, pady=(5, 10)
         )
-        self.input_video_label.pack(padx=10, pady=10, anchor="w")
 
         # Output directory selection
-        self.output_directory_frame = customtkinter.CTkFrame(master=self)
-        self.output_directory_frame.pack(fill="x", expand=1, padx=10, pady=10)
-
         self.output_directory_button = customtkinter.CTkButton(
-            master=self.output_directory_frame,
+            master=self,
             text="Select output directory",
             command=self.select_output_directory,
         )
-        self.output_directory_button.pack(padx=10, pady=10, fill="x")
+        self.output_directory_button.grid(
+            row=2, column=0, columnspan=2, sticky="ew", padx=10, pady=(10, 0)
+        )
         self.output_directory_label = customtkinter.CTkLabel(
-            master=self.output_directory_frame, text="Selected:"
+            master=self, text="Selected:"
+        )
+        self.output_directory_label.grid(
+            row=3, column=0, columnspan=2, sticky="w", padx=10, pady=(5, 10)
         )
-        self.output_directory_label.pack(padx=10, pady=10, anchor="w")
 
         # Field of view input
-        self.fov_frame = customtkinter.CTkFrame(master=self)
-        self.fov_frame.pack(fill="x", expand=1, padx=10, pady=10)
-
-        self.fov_input_label = customtkinter.CTkLabel(
-            master=self.fov_frame, text="FOV (1-360):"
-        )
-        self.fov_input_label.pack(padx=10, pady=10, side="left")
+        self.fov_input_label = customtkinter.CTkLabel(master=self, text="FOV (1-360):")
+        self.fov_input_label.grid(row=4, column=0, sticky="w", padx=10, pady=10)
         self.fov_input = ControledEntry(
-            master=self.fov_frame,
+            master=self,
             control_function=validate_fov_entry,
             width=40,
             justify="center",
             textvariable=self.fov_var,
         )
-        self.fov_input.pack(padx=10, pady=10, side="left")
+        self.fov_input.grid(row=4, column=1, sticky="w", padx=10, pady=10)
+
+        # Conversion mode selection
+        self.resumable_checkbox = customtkinter.CTkCheckBox(
+            master=self,
+            text="Resumable conversion (slower, can be continued after an interruption)",
+            variable=self.resumable_var,
+        )
+        self.resumable_checkbox.grid(
+            row=5, column=0, columnspan=2, sticky="w", padx=10, pady=10
+        )
 
         # Start conversion button
         self.start_conversion_button = customtkinter.CTkButton(
             master=self, text="START CONVERSION", command=self.start_conversion
         )
-        self.start_conversion_button.pack(padx=10, pady=10, fill="x")
+        self.start_conversion_button.grid(
+            row=6, column=0, columnspan=2, sticky="ew", padx=10, pady=10
+        )
 
         # Error label
         self.error_label = customtkinter.CTkLabel(
@@ -132,11 +162,13 @@ class NewConversionTab(customtkinter.CTkFrame):
             text=f"Selected: {self.input_video_path_var.get()}"
         )
 
-        input_video_directory = os.path.dirname(self.input_video_path_var.get())
-        self.output_directory_path_var.set(input_video_directory)
-        self.output_directory_label.configure(
-            text=f"Selected: {self.output_directory_path_var.get()}"
-        )
+        # Defaulting the output directory to the video directory unless one is already selected
+        if not self.output_directory_path_var.get():
+            input_video_directory = os.path.dirname(self.input_video_path_var.get())
+            self.output_directory_path_var.set(input_video_directory)
+            self.output_directory_label.configure(
+                text=f"Selected: {self.output_directory_path_var.get()}"
+            )
 
     def select_output_directory(self):
         """Opens a file dialog to select an output directory."""
@@ -156,10 +188,11 @@ class NewConversionTab(customtkinter.CTkFrame):
 
         if not self.validate_variables():
             return
-        self.master.master.master.start_new_conversion(
+        self.app.start_new_conversion(
             self.input_video_path_var.get(),
             self.output_directory_path_var.get(),
             int(self.fov_var.get()),
+            self.resumable_var.get(),
         )
 
     def set_error_message(self, message: str):
@@ -171,10 +204,10 @@ class NewConversionTab(customtkinter.CTkFrame):
 
         if message == "":
             self.error_label.configure(text="")
-            self.error_label.pack_forget()
+            self.error_label.grid_remove()
         else:
             self.error_label.configure(text=message)
-            self.error_label.pack(padx=10, pady=10)
+            self.error_label.grid(row=7, column=0, columnspan=2, padx=10, pady=10)
 
     def validate_variables(self) -> bool:
         """Validates the input variables and sets an error message if necessary."""
@@ -221,35 +254,40 @@ class ContinueConversionTab(customtkinter.CTkFrame):
     Tab view for continuing a conversion. Validates input and starts the conversion process.
     """
 
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, app, **kwargs):
         super().__init__(master, **kwargs)
 
-        # Initializing the converter
-        self.converter = Converter(lambda x: print(x))
+        # Using the application and its shared converter
+        self.app = app
+        self.converter = app.converter
 
         # Initializing conversion parameters
         self.conversion_directory_path_var = customtkinter.StringVar()
 
-        # Conversion directory selection
-        self.conversion_directory_frame = customtkinter.CTkFrame(master=self)
-        self.conversion_directory_frame.pack(fill="x", expand=1, padx=10, pady=10)
+        # Widgets are placed directly on the tab in a grid
+        self.grid_columnconfigure(0, weight=1)
 
+        # Conversion directory selection
         self.conversion_directory_button = customtkinter.CTkButton(
-            master=self.conversion_directory_frame,
+            master=self,
             text="Select conversion directory",
             command=self.select_conversion_directory,
         )
-        self.conversion_directory_button.pack(padx=10, pady=10, fill="x")
+        self.conversion_directory_button.grid(
+            row=0, column=0, sticky="ew", padx=10, pady=(10, 0)
+        )
         self.conversion_directory_label = customtkinter.CTkLabel(
-            master=self.conversion_directory_frame, text="Selected:"
+            master=self, text="Selected:"
+        )
+        self.conversion_directory_label.grid(
+            row=1, column=0, sticky="w", padx=10, pady=(5, 10)
         )
-        self.conversion_directory_label.pack(padx=10, pady=10, anchor="w")
 
         # Start conversion button
         self.start_conversion_button = customtkinter.CTkButton(
             master=self, text="START CONVERSION", command=self.start_conversion
         )
-        self.start_conversion_button.pack(padx=10, pady=10, fill="x")
+        self.start_conversion_button.grid(row=2, column=0, sticky="ew", padx=10, pady=10)
 
         # Error label
         self.error_label = customtkinter.CTkLabel(
@@ -275,7 +313,7 @@ class ContinueConversionTab(customtkinter.CTkFrame):
         if not self.validate_variables():
             return
 
-        self.master.master.master.continue_conversion(
+        self.app.continue_conversion(
             self.conversion_directory_path_var.get()
         )
 
@@ -288,10 +326,10 @@ class ContinueConversionTab(customtkinter.CTkFrame):
 
         if message == "":
             self.error_label.configure(text="")
-            self.error_label.pack_forget()
+            self.error_label.grid_remove()
         else:
             self.error_label.configure(text=message)
-            self.error_label.pack(padx=10, pady=10)
+            self.error_label.grid(row=3, column=0, padx=10, pady=10)
 
     def validate_variables(self) -> bool:
         """Validates the input variables and sets an error message if necessary."""
@@ -303,9 +341,16 @@ class ContinueConversionTab(customtkinter.CTkFrame):
         elif not self.converter.check_path_to_conversion_dir(
             self.conversion_directory_path_var.get()
         ):
-            self.set_error_message(
-                "Invalid conversion directory. Please select a different directory."
-            )
+            if self.converter.check_legacy_conversion_dir(
+                self.conversion_directory_path_var.get()
+            ):
+                self.set_error_message(
+                    "This conversion was started by an older version of the app and cannot be continued. Please start it again."
+                )
+            else:
+                self.set_error_message(
+                    "Invalid conversion directory. Please select a different directory."
+                )
             return False
 
         # Removing error message
@@ -319,16 +364,16 @@ class MyTabView(customtkinter.CTkTabview):
     - Continue conversion
     """
 
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, app, **kwargs):
         super().__init__(master, **kwargs)
 
         # create tabs
         self.add("new")
         self.add("continue")
-        self.new_conversion_tab = NewConversionTab(master=self.tab("new"))
+        self.new_conversion_tab = NewConversionTab(master=self.tab("new"), app=app)
         self.new_conversion_tab.pack(fill="x", expand=1)
         self.continue_conversion_tab = ContinueConversionTab(
-            master=self.tab("continue")
+            master=self.tab("continue"), app=app
         )
         self.continue_conversion_tab.pack(fill="x", expand=1)
 
@@ -368,41 +413,112 @@ class ConversionProgressFrame(customtkinter.CTkFrame):
         self.progress_bar.pack(padx=10, pady=5, fill="x")
         self.progress_bar.set(0)
 
-        # Logs
-        self.logs_frame = customtkinter.CTkScrollableFrame(
-            master=self, height=50, label_text="Logs:"
-        )
-        self.logs_frame.pack(fill="both", padx=10, pady=10)
-        self.logs_label = customtkinter.CTkLabel(master=self.logs_frame, text="", justify="left")
-        self.logs_label.pack(padx=10, pady=0, anchor="w")
-
-    def update_progress(self, progress_data: dict):
-        """Function for updating gui with new progress data."""
+        # Logs, newest first, only the most recent lines are kept
+        self.logs_title_label = customtkinter.CTkLabel(master=self, text="Logs:")
+        self.logs_title_label.pack(padx=10, pady=(10, 0), anchor="w")
+        self.logs_textbox = customtkinter.CTkTextbox(master=self, height=100, wrap="word")
+        self.logs_textbox.pack(fill="both", expand=1, padx=10, pady=(0, 10))
+        self.logs_textbox.configure(state="disabled")
+        self.max_log_lines = 200
+        self.new_log_lines = []
+
+        # Last drawn values, widgets are reconfigured only when these change
+        self.last_values = {
+            "title": "Converting video...",
+            "video": None,
+            "fov": None,
+            "percentage": None,
+        }
+
+        # Handlers for the events coming from the progress queue
+        self.event_handlers = {
+            "progress": self.on_progress,
+            "done": self.on_done,
+            "error": self.on_error,
+        }
+        self.latest_progress_data = None
+
+        # Last formatted log time as (second, text), logs in the same second reuse the text
+        self.log_time_cache = (None, "")
+
+    def update_progress(self, progress_data_list: list):
+        """Function for updating gui with a batch of new progress data.
+        Only the latest progress state is drawn, logs from the whole batch are inserted at once."""
+
+        # Handling events from the batch
+        self.latest_progress_data = None
+        self.new_log_lines = []
+        for progress_data in progress_data_list:
+            self.event_handlers[progress_data.get("event", "progress")](progress_data)
+
+        # Showing the new logs on top and dropping the oldest ones
+        if self.new_log_lines:
+            self.logs_textbox.configure(state="normal")
+            self.logs_textbox.insert("1.0", "".join(reversed(self.new_log_lines)))
+            self.logs_textbox.delete(f"{self.max_log_lines + 1}.0", "end")
+            self.logs_textbox.configure(state="disabled")
+        if self.latest_progress_data is None:
+            return
 
-        # Updating the title label
-        if progress_data["completion_percentage"] == 100:
-            self.title_label.configure(text="Conversion finished!")
+        # Reading the latest values once
+        video = self.latest_progress_data["video_name"]
+        fov = self.latest_progress_data["fov"]
+        percentage = self.latest_progress_data["completion_percentage"]
+        last_values = self.last_values
 
         # Updating video and fov labels
-        self.video_label.configure(
-            text=f"Video: {progress_data['video_name']}"
-        )
-        self.fov_label.configure(
-            text=f"FOV: {progress_data['fov']}"
-        )
+        if video != last_values["video"]:
+            self.video_label.configure(text=f"Video: {video}")
+            last_values["video"] = video
+        if fov != last_values["fov"]:
+            self.fov_label.configure(text=f"FOV: {fov}")
+            last_values["fov"] = fov
+
+        # Updating the progress label and the progress bar
+        if percentage != last_values["percentage"]:
+            self.progress_label.configure(text=f"Finished: {percentage}%")
+            self.progress_bar.set(percentage / 100)
+            last_values["percentage"] = percentage
+
+    def on_progress(self, progress_data: dict):
+        """Handles a progress event by adding its log and marking it as the latest progress."""
+
+        # Reading the log values once
+        timestamp = progress_data["timestamp"]
+        current_process = progress_data["current_process"]
+        message = progress_data["message"]
 
-        # Updating the progress label
-        self.progress_label.configure(text=f"Finished: {progress_data['completion_percentage']}%")
+        # Adding new log
+        second = int(timestamp.timestamp())
+        if second != self.log_time_cache[0]:
+            self.log_time_cache = (second, timestamp.strftime("%H:%M:%S"))
+        formated_time = self.log_time_cache[1]
+        new_log = f"{formated_time}  -  {current_process}  -  {message}\n"
+        self.new_log_lines.append(new_log)
 
-        # Updating the progress bar
-        self.progress_bar.set(progress_data["completion_percentage"] / 100)
+        self.latest_progress_data = progress_data
+        self.set_title("Converting video...")
 
-        # Adding new log
+    def set_title(self, title: str):
+        """Sets the title label, reconfiguring it only when the title changes."""
+
+        if title != self.last_values["title"]:
+            self.title_label.configure(text=title)
+            self.last_values["title"] = title
+
+    def on_done(self, progress_data: dict):
+        """Handles the event sent once the conversion is completed."""
+
+        self.set_title("Conversion finished!")
+
+    def on_error(self, progress_data: dict):
+        """Handles the event sent when a conversion fails, showing the error in the logs."""
+
+        self.set_title("Conversion failed!")
         formated_time = progress_data["timestamp"].strftime("%H:%M:%S")
-        new_log = f"{formated_time}  -  {progress_data["current_process"]}  -  {progress_data["message"]}\n"
-        old_logs = self.logs_label.cget("text")
-        combined_logs = new_log + old_logs
-        self.logs_label.configure(text=combined_logs)
+        self.new_log_lines.append(
+            f"{formated_time}  -  Error  -  {progress_data['message']}\n"
+        )
 
 
 class App(customtkinter.CTk):
@@ -411,80 +527,122 @@ class App(customtkinter.CTk):
     """
 
     def __init__(self):
+        # Setting the appearance mode before any widget is drawn
+        customtkinter.set_appearance_mode("dark")
+
         super().__init__()
 
         # Setting up the main window
-        customtkinter.set_appearance_mode("dark")
         self.title("Fisheye converter")
         self.minsize(width=600, height=100)
 
-        # Initializing the converter and progress queue
-        self.thread = None
-        self.progress_queue = queue.Queue()
-        self.converter = Converter(self.progress_queue.put)
+        # Initializing the converter and progress queue, a deque is enough for
+        # one producer and one consumer since appends and pops are atomic
+        self.progress_queue = collections.deque()
+        self.converter = Converter(
+            self.put_progress, lambda: self.put_progress({"event": "done"})
+        )
+        self.bind("<<Progress>>", lambda event: self.check_progress())
+
+        # Initializing the single conversion worker, conversions are run one at a time
+        self.conversion_queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run_conversion_worker)
+        self.thread.daemon = True
+        self.thread.start()
 
-        self.tab_view = MyTabView(master=self)
+        self.tab_view = MyTabView(master=self, app=self)
         self.tab_view.pack(fill="both", expand=1, padx=10, pady=(0, 20))
 
-        self.progress_frame = ConversionProgressFrame(master=self)
-        # self.progress_frame.pack(fill="both", expand=1, padx=10, pady=20)
+        # The progress frame is created when the first conversion starts
+        self.progress_frame = None
+
+    def put_progress(self, progress_data: dict):
+        """Puts new progress data in the queue and notifies the gui thread about it.
+        Called from the conversion thread."""
+
+        self.progress_queue.append(progress_data)
+        try:
+            self.event_generate("<<Progress>>", when="tail")
+        except (RuntimeError, tkinter.TclError):
+            # The main loop is not running anymore
+            pass
 
     def check_progress(self):
-        """Checks the progress queue for new progress data and updates the progress frame."""
+        """Checks the progress queue for new progress data and updates the progress frame.
+        Called on the gui thread whenever the conversion thread reports progress."""
 
-        # Emptying the queue and updating the progress frame
-        while not self.progress_queue.empty():
-            progress_data = self.progress_queue.get()
-            self.progress_frame.update_progress(progress_data)
+        # Emptying the queue
+        progress_data_list = []
+        try:
+            while True:
+                progress_data_list.append(self.progress_queue.popleft())
+        except IndexError:
+            pass
 
-        # Checking if the conversion thread is still running
-        if self.check_thread():
-            self.after(100, self.check_progress)
+        # Updating the progress frame once for the whole batch
+        if progress_data_list:
+            self.progress_frame.update_progress(progress_data_list)
 
     def start_new_conversion(
-        self, input_video_path: str, output_directory_path: str, fov: int
+        self,
+        input_video_path: str,
+        output_directory_path: str,
+        fov: int,
+        resumable: bool = True,
     ):
-        """Changes the view to the progress frame and starts a new conversion thread."""
+        """Changes the view to the progress frame and queues a new conversion.
+        Non resumable conversions run in a single faster pass."""
 
         # Changing the view
-        self.tab_view.pack_forget()
-        self.progress_frame.pack(fill="both", expand=1, padx=10, pady=20)
+        self.show_progress_frame()
 
-        # Starting the conversion thread
-        self.thread = threading.Thread(
-            target=self.converter.new_conversion,
-            args=(input_video_path, output_directory_path, fov),
+        # Queueing the conversion for the worker thread
+        if resumable:
+            conversion_function = self.converter.new_conversion
+        else:
+            conversion_function = self.converter.new_conversion_oneshot
+        self.conversion_queue.put(
+            (conversion_function, (input_video_path, output_directory_path, fov))
         )
-        self.thread.daemon = True
-        self.thread.start()
-
-        # Starting the progress check loop
-        self.check_progress()
 
     def continue_conversion(self, conversion_directory_path: str):
-        """Changes the view to the progress frame and starts a continue conversion thread."""
+        """Changes the view to the progress frame and queues a continue conversion."""
 
         # Changing the view
-        self.tab_view.pack_forget()
-        self.progress_frame.pack(fill="both", expand=1, padx=10, pady=20)
+        self.show_progress_frame()
 
-        # Starting the conversion thread
-        self.thread = threading.Thread(
-            target=self.converter.continue_conversion, args=(conversion_directory_path,)
+        # Queueing the conversion for the worker thread
+        self.conversion_queue.put(
+            (self.converter.continue_conversion, (conversion_directory_path,))
         )
-        self.thread.daemon = True
-        self.thread.start()
 
-        # Starting the progress check loop
-        self.check_progress()
+    def show_progress_frame(self):
+        """Replaces the tab view with the progress frame, creating the frame on first use."""
 
-    def check_thread(self) -> bool:
-        """Checks if the conversion thread is still running."""
+        if self.progress_frame is None:
+            self.progress_frame = ConversionProgressFrame(master=self)
+        self.tab_view.pack_forget()
+        self.progress_frame.pack(fill="both", expand=1, padx=10, pady=20)
 
-        if self.thread and self.thread.is_alive():
-            return True
-        else:
-            return False
+    def run_conversion_worker(self):
+        """Runs queued conversions one after another on the worker thread.
+        A failed conversion is reported to the progress frame and the next one is started."""
+
+        while True:
+            function, args = self.conversion_queue.get()
+            try:
+                function(*args)
+            except Exception as error:
+                traceback.print_exc()
+                self.put_progress(
+                    {
+                        "event": "error",
+                        "timestamp": datetime.datetime.now(),
+                        "message": str(error) or type(error).__name__,
+                    }
+                )
+            finally:
+                self.conversion_queue.task_done()
 
 
 # Running the application
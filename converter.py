@@ -1,11 +1,105 @@
+import asyncio
 import atexit
 import datetime
-import glob
+import json
+import math
 import os
-import shelve
+import signal
 import subprocess
-from pathlib import Path
-from typing import Callable, Dict, Literal, TypedDict
+import threading
+import time
+from typing import Callable, Dict, List, Literal, Optional, TypedDict
+
+# Number of threads used by each ffmpeg process converting a chunk
+FFMPEG_THREADS = 2
+
+# Longest chunk in seconds. Every chunk starts its own ffmpeg process and keyframe,
+# shorter chunks are used only to give each worker a chunk on short videos.
+MAX_CHUNK_LENGTH = 10
+
+# ffmpeg arguments of the supported video encoders, hardware encoders in order of preference
+# - input_args: arguments placed before the input
+# - filter_suffix: filters appended to the v360 filter
+# - output_args: encoder arguments, {threads} is replaced with the number of encoding threads
+# - max_workers: limit of chunks encoded at the same time, None for no limit
+ENCODERS = {
+    "hevc_nvenc": {
+        "input_args": ["-hwaccel", "cuda"],
+        "filter_suffix": "",
+        "output_args": [
+            "-c:v",
+            "hevc_nvenc",
+            "-preset",
+            "p5",
+            "-rc",
+            "vbr",
+            "-cq",
+            "22",
+            "-pix_fmt",
+            "yuv420p",
+        ],
+        # consumer GPUs allow only a few encoding sessions at once
+        "max_workers": 2,
+    },
+    "hevc_qsv": {
+        "input_args": [],
+        "filter_suffix": "",
+        "output_args": ["-c:v", "hevc_qsv", "-global_quality", "22", "-pix_fmt", "nv12"],
+        "max_workers": 2,
+    },
+    "hevc_vaapi": {
+        "input_args": ["-vaapi_device", "/dev/dri/renderD128"],
+        "filter_suffix": ",format=nv12,hwupload",
+        "output_args": ["-c:v", "hevc_vaapi", "-qp", "22"],
+        "max_workers": 2,
+    },
+    "libx265": {
+        "input_args": [],
+        "filter_suffix": "",
+        "output_args": [
+            "-threads",
+            "{threads}",
+            "-c:v",
+            "libx265",
+            "-x265-params",
+            "pools={threads}",
+            "-crf",
+            "18",
+            "-pix_fmt",
+            "yuv420p",
+        ],
+        "max_workers": None,
+    },
+}
+
+# Extensions of the supported input videos, compared in lower case
+VIDEO_EXTENSIONS = frozenset({".mp4", ".avi", ".mkv", ".webm", ".mov"})
+
+# Modes of the chunked conversion
+# - reproject: chunks are reprojected to equirectangular format and encoded
+# - copy: streams are copied without reprojecting them, the video is taken as a single chunk
+CONVERSION_MODES = ("reproject", "copy")
+
+# Video codecs that can be copied into MPEG-TS chunks, videos in other codecs have to be reprojected
+MPEG_TS_VIDEO_CODECS = frozenset(
+    {"h264", "hevc", "mpeg1video", "mpeg2video", "mpeg4"}
+)
+
+# Size of the blocks in which chunk files are piped to ffmpeg
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# ffmpeg arguments writing the progress of the conversion as key=value lines to stdout
+FFMPEG_PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+# Seconds a stopped ffmpeg process gets to exit before it is killed
+PROCESS_EXIT_TIMEOUT = 2
+
+# Flags hiding the console windows of ffmpeg processes on Windows, other systems accept only 0
+SUBPROCESS_CREATION_FLAGS = (
+    subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+    if os.name == "nt"
+    else 0
+)
 
 
 class StatusData(TypedDict):
@@ -15,19 +109,45 @@ class StatusData(TypedDict):
 
     completion_percentage: int
     current_process: Literal[
-        "INITIALIZING", "CONVERTING_CHUNKS", "MERGING", "CLEAN_UP", "FINISHED"
+        "INITIALIZING",
+        "CONVERTING_CHUNKS",
+        "CONVERTING",
+        "MERGING",
+        "CLEAN_UP",
+        "FINISHED",
     ]
     message: str
     timestamp: datetime
 
 
+class ConversionData(TypedDict):
+    """
+    Type for the conversion data saved as JSON in the conversion directory.
+    Converted chunks are not listed, a chunk is converted when its file exists.
+    """
+
+    chunks_count: int
+    fov: int
+    video_name: str
+    path_to_input_video: str
+    chunk_length: int
+    encoder: Optional[str]
+    mode: Literal["reproject", "copy"]
+
+
 # write docstring for class
 class Converter:
     """
     Converts side-by-side fisheye video to equirectangular video
     """
 
-    def __init__(self, callback: Callable[[StatusData], None]):
+    def __init__(
+        self,
+        callback: Callable[[StatusData], None],
+        done_callback: Optional[Callable[[], None]] = None,
+        max_workers: Optional[int] = None,
+        encoder: Optional[str] = None,
+    ):
         """
         Initializes the Converter object
 
@@ -35,19 +155,35 @@ class Converter:
             callback (Callable[[StatusData], None]): Callback function that will be called when the status of the conversion changes.
             StatusData is a dictionary with the following structure:
                 - completion_percentage (int): The percentage of the conversion process that has been completed.
-                - current_process (Literal["INITIALIZING", "CONVERTING_CHUNKS", "MERGING", "CLEAN_UP", "FINISHED"]): The current step in the conversion process.
+                - current_process (Literal["INITIALIZING", "CONVERTING_CHUNKS", "CONVERTING", "MERGING", "CLEAN_UP", "FINISHED"]): The current step in the conversion process.
                 - message (str): A message about the status of the conversion process.
                 - timestamp (datetime): The time of the status update.
+            done_callback (Callable[[], None], optional): Callback function that will be called once when the conversion is completed.
+            max_workers (int, optional): Number of chunks converted at the same time. Defaults to the number of CPUs divided by FFMPEG_THREADS.
+            encoder (str, optional): Video encoder used for new conversions, one of the ENCODERS keys.
+            Defaults to the first hardware encoder that works with the input video, or libx265 if there is none.
         """
 
+        if encoder is not None and encoder not in ENCODERS:
+            raise ValueError(f"encoder must be one of: {', '.join(ENCODERS)}")
+
         self.callback = callback
+        self.done_callback = done_callback
 
-        self.path_to_db = None
+        self.path_to_conversion_data = None
         self.path_to_conversion_dir = None
+        self.conversion_dir_prefix = None
         self.fov = None
         self.video_name = None
 
-        self.current_process = None
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 1) // FFMPEG_THREADS)
+        self.max_workers = max_workers
+        self.encoder = encoder
+
+        # Ids of the running ffmpeg processes, read by the exit handler from the main thread
+        self.current_process_ids = set()
+        self.current_process_ids_lock = threading.Lock()
         atexit.register(self.__cleanup)
 
     def check_path_to_input_video(self, path_to_input_video: str) -> bool:
@@ -61,13 +197,11 @@ class Converter:
             bool: True if the path is correct, False otherwise
         """
 
-        if not os.path.isfile(path_to_input_video):
-            return False
-        # checking file extension
-        extension = Path(path_to_input_video).suffix
-        if extension not in [".mp4", ".avi", ".mkv", ".webm", ".mov"]:
+        # checking file extension first, it does not need to touch the disk
+        extension = os.path.splitext(path_to_input_video)[1].lower()
+        if extension not in VIDEO_EXTENSIONS:
             return False
-        return True
+        return os.path.isfile(path_to_input_video)
 
     def check_path_to_output(self, path_to_output: str) -> bool:
         """
@@ -84,7 +218,7 @@ class Converter:
 
     def check_path_to_conversion_dir(self, path_to_conversion_dir: str) -> bool:
         """
-        Checks if the path to the conversion directory is correct and the database is not corrupted
+        Checks if the path to the conversion directory is correct and the conversion data is not corrupted
 
         Args:
             path_to_conversion_dir (str): Path to the conversion directory
@@ -93,41 +227,60 @@ class Converter:
             bool: True if the path is correct, False otherwise
         """
 
-        # Checking if the path exists
-        if not os.path.exists(path_to_conversion_dir):
-            return False
-
-        # Checking if database files exists
-        if not os.path.exists(
-            os.path.join(path_to_conversion_dir, "conversion_data.dat")
-        ):
-            return False
-        if not os.path.exists(
-            os.path.join(path_to_conversion_dir, "conversion_data.dir")
-        ):
-            return False
-        if not os.path.exists(
-            os.path.join(path_to_conversion_dir, "conversion_data.bak")
-        ):
-            return False
-
-        # Checking if the database is not corrupted
-        path_to_db = os.path.join(path_to_conversion_dir, "conversion_data")
+        # Checking if the conversion data exists and is not corrupted,
+        # a missing directory or file fails to open so it is not checked separately
+        path_to_conversion_data = os.path.join(
+            path_to_conversion_dir, "conversion_data.json"
+        )
         try:
-            with shelve.open(path_to_db) as db:
-                if not isinstance(db["chunks_all"], list):
-                    return False
-                if not isinstance(db["chunks_to_convert"], list):
-                    return False
-                if not isinstance(db["fov"], int):
-                    return False
-                if not isinstance(db["video_name"], str):
-                    return False
+            with open(path_to_conversion_data) as f:
+                conversion_data = json.load(f)
+            if not isinstance(conversion_data["chunks_count"], int):
+                return False
+            if not isinstance(conversion_data["fov"], int):
+                return False
+            if not isinstance(conversion_data["video_name"], str):
+                return False
+            if not isinstance(conversion_data["chunk_length"], int):
+                return False
+            if conversion_data["mode"] not in CONVERSION_MODES:
+                return False
+            # copied video is not encoded, so it has no encoder
+            if (
+                conversion_data["mode"] == "reproject"
+                and conversion_data["encoder"] not in ENCODERS
+            ):
+                return False
+            # chunks are read from the input video, so it must still exist
+            if not os.path.isfile(conversion_data["path_to_input_video"]):
+                return False
         except Exception:
             return False
 
         return True
 
+    def check_legacy_conversion_dir(self, path_to_conversion_dir: str) -> bool:
+        """
+        Checks if the conversion directory was created by an older version of the converter,
+        which saved the conversion data in a shelve database. Such conversions cannot be continued.
+
+        Args:
+            path_to_conversion_dir (str): Path to the conversion directory
+
+        Returns:
+            bool: True if the directory holds the old conversion database, False otherwise
+        """
+
+        # depending on the dbm module used by shelve, the database is one or several files
+        return any(
+            os.path.exists(os.path.join(path_to_conversion_dir, file_name))
+            for file_name in (
+                "conversion_data.dat",
+                "conversion_data.db",
+                "conversion_data",
+            )
+        )
+
     def check_fov(self, fov) -> bool:
         """
         Checks if the field of view is a valid integer from the range of 1 to 360
@@ -153,6 +306,7 @@ class Converter:
         path_to_input_video: str,
         path_to_output: str,
         fov: int,
+        mode: Literal["reproject", "copy"] = "reproject",
     ):
         """
         Initializes a new conversion process
@@ -161,7 +315,8 @@ class Converter:
             path_to_input_video (str): Path to the input video
             path_to_output (str): Path to the output directory
             fov (str): Field of view
-            chunk_length (str): Length of each chunk in seconds
+            mode (Literal["reproject", "copy"], optional): Mode of the conversion, one of CONVERSION_MODES. Defaults to "reproject".
+            The copy mode works only with videos in one of MPEG_TS_VIDEO_CODECS.
         """
 
         # checking paths
@@ -175,11 +330,29 @@ class Converter:
             raise TypeError("fov must be an integer from 1 to 360")
         self.fov = fov
 
+        # checking mode
+        if mode not in CONVERSION_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(CONVERSION_MODES)}")
+
         # getting input video name
         self.video_name = os.path.basename(path_to_input_video)
         video_name_without_extension = self.__get_name_without_extension(
             self.video_name
         )
+        if mode == "reproject" and fov == 360:
+            self.__update_status(
+                "INITIALIZING",
+                "Field of view is 360, the fisheye image is expected to cover the full sphere",
+            )
+
+        # checking if the video can be copied into MPEG-TS chunks, audio is converted to AAC anyway
+        if mode == "copy":
+            self.__update_status("INITIALIZING", "Reading video codec")
+            video_codec = self.__get_video_codec(path_to_input_video)
+            if video_codec not in MPEG_TS_VIDEO_CODECS:
+                raise ValueError(
+                    f"Video codec {video_codec} cannot be copied, the video has to be reprojected"
+                )
 
         # creating conversion directory
         self.__update_status("INITIALIZING", "Creating conversion directory")
@@ -187,37 +360,143 @@ class Converter:
         self.path_to_conversion_dir = os.path.join(
             path_to_output, f"{video_name_without_extension}_converted_{current_time}"
         )
+        self.conversion_dir_prefix = os.path.join(self.path_to_conversion_dir, "")
         os.mkdir(self.path_to_conversion_dir)
 
-        # cutting video into chunks
-        self.__update_status("INITIALIZING", "Cutting video into chunks")
-        chunk_length = 1
-        extension = Path(path_to_input_video).suffix
-        command = f'ffmpeg -i "{path_to_input_video}" -c copy -map 0 -segment_time {chunk_length} -f segment -reset_timestamps 1 "{self.path_to_conversion_dir}/%d{extension}"'
-        self.__run_command(command)
-
-        # getting reversed list of created chunks names
-        chunk_paths = glob.glob(self.__get_full_path("[0-9]*"))
-
-        def sort_key(path):
-            filename = os.path.basename(path)
-            basename, _ = os.path.splitext(filename)
-            return int(basename)
-
-        sorted_chunk_paths = sorted(chunk_paths, key=sort_key, reverse=True)
-        chunks = [os.path.basename(file) for file in sorted_chunk_paths]
-
-        # initializing database
-        self.__update_status("INITIALIZING", "Creating conversion data files")
-        self.path_to_db = self.__get_full_path("conversion_data")
-        with shelve.open(self.path_to_db) as db:
-            db["chunks_all"] = chunks
-            db["chunks_to_convert"] = chunks
-            db["fov"] = fov
-            db["video_name"] = self.video_name
+        # choosing the encoder, continued conversions keep it so all chunks are encoded the same way.
+        # Copied video is not encoded, so no encoder is chosen for it.
+        encoder = None
+        if mode == "reproject":
+            encoder = self.encoder
+            if encoder is None:
+                self.__update_status(
+                    "INITIALIZING", "Detecting available video encoders"
+                )
+                encoder = asyncio.run(self.__detect_encoder(path_to_input_video, fov))
+
+        # splitting video into chunks, chunks are read straight from the input video when converted
+        self.__update_status("INITIALIZING", "Reading video duration")
+        duration = self.__get_video_duration(path_to_input_video)
+        if mode == "copy":
+            # copying is limited by the disk, splitting the video would only add ffmpeg processes
+            chunk_length = max(1, math.ceil(duration))
+        else:
+            chunk_length = max(
+                1,
+                min(
+                    MAX_CHUNK_LENGTH,
+                    math.floor(duration / self.__get_workers_count(encoder)),
+                ),
+            )
+        chunks_count = max(1, math.ceil(duration / chunk_length))
+
+        # initializing conversion data
+        self.__update_status("INITIALIZING", "Creating conversion data file")
+        self.path_to_conversion_data = self.__get_full_path("conversion_data.json")
+        conversion_data: ConversionData = {
+            "chunks_count": chunks_count,
+            "fov": fov,
+            "video_name": self.video_name,
+            "path_to_input_video": os.path.abspath(path_to_input_video),
+            "chunk_length": chunk_length,
+            "encoder": encoder,
+            "mode": mode,
+        }
+        self.__save_conversion_data(conversion_data)
 
         # starting conversion
-        self.__run_conversion()
+        asyncio.run(self.__run_conversion())
+
+    def new_conversion_oneshot(
+        self,
+        path_to_input_video: str,
+        path_to_output: str,
+        fov: int,
+    ):
+        """
+        Converts the whole video with a single ffmpeg process using all CPU threads.
+        Faster than the chunked conversion, but an interrupted conversion cannot be continued.
+
+        Args:
+            path_to_input_video (str): Path to the input video
+            path_to_output (str): Path to the output directory
+            fov (str): Field of view
+        """
+
+        # checking paths
+        if not self.check_path_to_input_video(path_to_input_video):
+            raise FileNotFoundError("Input video not found")
+        if not self.check_path_to_output(path_to_output):
+            raise FileNotFoundError("Output directory not found")
+
+        # checking fov
+        if not self.check_fov(fov):
+            raise TypeError("fov must be an integer from 1 to 360")
+        self.fov = fov
+
+        # getting input video name
+        self.video_name = os.path.basename(path_to_input_video)
+        video_name_without_extension = self.__get_name_without_extension(
+            self.video_name
+        )
+
+        # reading video duration for the progress
+        self.__update_status("INITIALIZING", "Reading video duration")
+        duration = self.__get_video_duration(path_to_input_video)
+
+        # choosing the encoder
+        encoder = self.encoder
+        if encoder is None:
+            self.__update_status("INITIALIZING", "Detecting available video encoders")
+            encoder = asyncio.run(self.__detect_encoder(path_to_input_video, fov))
+        encoder_settings = ENCODERS[encoder]
+
+        # converting video, the progress is read from the time reported by ffmpeg
+        self.__update_status("CONVERTING", "Converting video")
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_file_path = os.path.join(
+            path_to_output,
+            f"{video_name_without_extension}_converted_{current_time}.mp4",
+        )
+        threads = os.cpu_count() or 1
+        command = [
+            "ffmpeg",
+            *FFMPEG_PROGRESS_ARGS,
+            "-filter_threads",
+            str(threads),
+            *encoder_settings["input_args"],
+            "-i",
+            path_to_input_video,
+            "-filter:v",
+            self.__get_video_filter(fov, encoder_settings),
+            "-map",
+            "0",
+            *self.__get_output_args(encoder_settings, threads),
+            output_file_path,
+        ]
+        last_percentage = 0
+
+        def read_progress(progress: Dict[str, str]):
+            nonlocal last_percentage
+            converted_time = self.__get_progress_time(progress)
+            if converted_time is None:
+                return
+            completion = min(1, converted_time / duration)
+            percentage = round(completion * 100)
+            if percentage != last_percentage:
+                last_percentage = percentage
+                self.__update_status(
+                    "CONVERTING", f"Converted {percentage}% of the video", completion
+                )
+
+        # a failed conversion leaves a partial video, which is removed
+        if asyncio.run(self.__run_command(command, read_progress)) != 0:
+            self.__remove_file(output_file_path)
+            raise RuntimeError("ffmpeg failed to convert the video")
+
+        self.__update_status("FINISHED", "Conversion completed")
+        if self.done_callback is not None:
+            self.done_callback()
 
     def continue_conversion(self, path_to_conversion_dir: str):
         """
@@ -229,73 +508,271 @@ class Converter:
 
         # saving paths
         self.path_to_conversion_dir = path_to_conversion_dir
-        self.path_to_db = self.__get_full_path("conversion_data")
+        self.conversion_dir_prefix = os.path.join(path_to_conversion_dir, "")
+        self.path_to_conversion_data = self.__get_full_path("conversion_data.json")
 
         # checking conversion directory
         if not self.check_path_to_conversion_dir(path_to_conversion_dir):
+            if self.check_legacy_conversion_dir(path_to_conversion_dir):
+                raise ValueError(
+                    "Conversion was started by an older version and cannot be continued, please start it again"
+                )
             raise FileNotFoundError("Conversion directory not found")
 
         # loading fov and video name
-        with shelve.open(self.path_to_db) as db:
-            self.fov = db["fov"]
-            self.video_name = db["video_name"]
+        conversion_data = self.__load_conversion_data()
+        self.fov = conversion_data["fov"]
+        self.video_name = conversion_data["video_name"]
 
         # continuing the conversion
-        self.__run_conversion()
+        asyncio.run(self.__run_conversion())
 
-    def __run_conversion(self):
+    async def __run_conversion(self):
         """
         Runs the conversion process
         """
 
-        self.__convert_chunks()
-        self.__merge_chunks()
-        self.__delete_database()
+        # the conversion data does not change during the conversion, so it is loaded once
+        conversion_data = self.__load_conversion_data()
+        await self.__convert_chunks(conversion_data)
+        await self.__merge_chunks(conversion_data)
+        self.__delete_conversion_data()
         self.__update_status("FINISHED", "Conversion completed")
+        if self.done_callback is not None:
+            self.done_callback()
 
-    def __convert_chunks(self):
+    async def __convert_chunks(self, conversion_data: ConversionData):
         """
-        Converts chunks to equirectangular format
+        Converts chunks to equirectangular format, several chunks at the same time
+
+        Args:
+            conversion_data (ConversionData): Loaded conversion data
         """
 
-        # converting chunks
-        convert_chunks = True
-        while convert_chunks:
+        # getting chunks to convert
+        chunks_count = conversion_data["chunks_count"]
+        chunks_to_convert = self.__get_chunks_to_convert(chunks_count)
+
+        # completion of the chunks being converted, reported by ffmpeg
+        chunks_completion = {}
+        last_percentage = None
+
+        def update_progress(message: str):
+            nonlocal last_percentage
+            converted_chunks = chunks_count - len(chunks_to_convert)
+            completion = (
+                converted_chunks + sum(chunks_completion.values())
+            ) / chunks_count
+            percentage = round(completion * 97)
+            if percentage != last_percentage:
+                last_percentage = percentage
+                self.__update_status("CONVERTING_CHUNKS", message, completion)
+
+        # settings used for each chunk
+        chunk_settings = {
+            "update_progress": update_progress,
+            "chunks_completion": chunks_completion,
+            "chunks_to_convert": chunks_to_convert,
+            "fov": conversion_data["fov"],
+            "path_to_input_video": conversion_data["path_to_input_video"],
+            "chunk_length": conversion_data["chunk_length"],
+            "encoder": conversion_data["encoder"],
+            "mode": conversion_data["mode"],
+        }
+
+        # limiting the number of chunks converted at the same time
+        workers_semaphore = asyncio.Semaphore(
+            self.__get_workers_count(chunk_settings["encoder"])
+        )
 
-            # getting chunks to convert
-            with shelve.open(self.path_to_db) as db:
-                chunks_to_convert = db["chunks_to_convert"]
-                fov = db["fov"]
+        # the first error stops starting new chunks, chunks being converted are finished
+        errors = []
+
+        async def convert_chunk(chunk: str):
+            async with workers_semaphore:
+                if errors:
+                    return
+                try:
+                    await self.__convert_chunk(chunk, **chunk_settings)
+                except Exception as error:
+                    errors.append(error)
+
+        # converting chunks, a copy of the list is used as converted chunks are removed from it
+        await asyncio.gather(
+            *(convert_chunk(chunk) for chunk in list(chunks_to_convert))
+        )
 
-            # breaking loop if no chunks to convert
-            if not chunks_to_convert:
-                convert_chunks = False
-                break
+        # passing the first error to the caller
+        if errors:
+            raise errors[0]
 
-            # converting chunk
-            current_chunk = chunks_to_convert.pop()
-            self.__update_status(
-                "CONVERTING_CHUNKS", f"Converting chunk {current_chunk}"
-            )
-            current_chunk_name = self.__get_name_without_extension(current_chunk)
-            current_chunk_path = self.__get_full_path(current_chunk)
-            converted_chunk_path = self.__get_full_path(
-                f"{current_chunk_name}_conv.mp4"
-            )
-            self.__remove_file(converted_chunk_path)
-            command = f'ffmpeg -i "{current_chunk_path}" -filter:v "v360=input=fisheye:ih_fov={fov}:iv_fov={fov}:output=hequirect:in_stereo=sbs:out_stereo=sbs" -map 0 -c:v libx265 -crf 18 -pix_fmt yuv420p "{converted_chunk_path}"'
-            self.__run_command(command)
+    async def __convert_chunk(
+        self,
+        chunk: str,
+        update_progress: Callable[[str], None],
+        chunks_completion: Dict[str, float],
+        chunks_to_convert: List[str],
+        fov: int,
+        path_to_input_video: str,
+        chunk_length: int,
+        encoder: Optional[str],
+        mode: Literal["reproject", "copy"],
+    ):
+        """
+        Converts a single chunk to equirectangular format and removes it from the chunks to convert.
+        The chunk is cut from the input video by the same ffmpeg process that converts it.
+        In the copy mode the streams of the chunk are copied, only the audio is converted to AAC.
+
+        Args:
+            chunk (str): Name of the chunk, the chunk number
+            update_progress (Callable[[str], None]): Function reporting the progress of all chunks with a message
+            chunks_completion (Dict[str, float]): Completion of the chunks being converted from 0 to 1
+            chunks_to_convert (List[str]): Chunks that are not converted yet
+            fov (int): Field of view
+            path_to_input_video (str): Path to the input video
+            chunk_length (int): Length of each chunk in seconds
+            encoder (str, optional): Video encoder, one of the ENCODERS keys, None in the copy mode
+            mode (Literal["reproject", "copy"]): Mode of the conversion, one of CONVERSION_MODES
+        """
 
-            # updating database
-            with shelve.open(self.path_to_db) as db:
-                db["chunks_to_convert"] = chunks_to_convert
+        # converting chunk, the progress is read from the time reported by ffmpeg.
+        # Chunks are saved as MPEG-TS with timestamps continuing from the previous chunk,
+        # so they can be joined by appending their bytes. Negative timestamps are kept,
+        # otherwise only the first chunk would be shifted and overlap the second one.
+        update_progress(f"Converting chunk {chunk}")
+        chunk_start = int(chunk) * chunk_length
+        # ffmpeg writes to a part file, which is renamed only when the whole chunk is converted
+        part_chunk_path = self.__get_full_path(f"{chunk}_part.ts")
+        converted_chunk_path = self.__get_full_path(f"{chunk}_conv.ts")
+        self.__remove_file(part_chunk_path)
+        # audio is always converted to AAC, which MPEG-TS can carry and mp4 accepts when merging
+        if mode == "copy":
+            input_args = []
+            codec_args = ["-c", "copy", "-c:a", "aac"]
+        else:
+            encoder_settings = ENCODERS[encoder]
+            input_args = encoder_settings["input_args"]
+            codec_args = [
+                "-filter:v",
+                self.__get_video_filter(fov, encoder_settings),
+                *self.__get_output_args(encoder_settings, FFMPEG_THREADS),
+                "-c:a",
+                "aac",
+            ]
+        command = [
+            "ffmpeg",
+            *FFMPEG_PROGRESS_ARGS,
+            *input_args,
+            "-ss",
+            str(chunk_start),
+            "-t",
+            str(chunk_length),
+            "-i",
+            path_to_input_video,
+            "-map",
+            "0",
+            *codec_args,
+            "-avoid_negative_ts",
+            "disabled",
+            "-output_ts_offset",
+            str(chunk_start),
+            part_chunk_path,
+        ]
+
+        def read_progress(progress: Dict[str, str]):
+            converted_time = self.__get_progress_time(progress)
+            if converted_time is None:
+                return
+            chunks_completion[chunk] = min(1, converted_time / chunk_length)
+            update_progress(f"Converting chunk {chunk}")
+
+        if await self.__run_command(command, read_progress) != 0:
+            raise RuntimeError(f"ffmpeg failed to convert chunk {chunk}")
+
+        # marking chunk as converted, the existing file keeps it converted after an interruption
+        os.replace(part_chunk_path, converted_chunk_path)
+        chunks_completion.pop(chunk, None)
+        chunks_to_convert.remove(chunk)
+
+    def __get_chunks_to_convert(self, chunks_count: int) -> List[str]:
+        """
+        Returns the chunks that are not converted yet, read from a single listing of the conversion directory
 
-            # deleting original chunk
-            os.remove(current_chunk_path)
+        Args:
+            chunks_count (int): Number of all chunks
 
-    def __merge_chunks(self):
+        Returns:
+            List[str]: Names of the chunks to convert, the chunk numbers in ascending order
+        """
+
+        file_names = {entry.name for entry in os.scandir(self.path_to_conversion_dir)}
+        return [
+            str(chunk_number)
+            for chunk_number in range(chunks_count)
+            if f"{chunk_number}_conv.ts" not in file_names
+        ]
+
+    def __get_workers_count(self, encoder: Optional[str]) -> int:
+        """
+        Returns the number of chunks converted at the same time with an encoder
+
+        Args:
+            encoder (str, optional): Video encoder, one of the ENCODERS keys, None for copied video
+
+        Returns:
+            int: max_workers limited by the encoder
+        """
+
+        if encoder is None:
+            return self.max_workers
+        encoder_max_workers = ENCODERS[encoder]["max_workers"]
+        if encoder_max_workers is None:
+            return self.max_workers
+        return min(self.max_workers, encoder_max_workers)
+
+    async def __detect_encoder(self, path_to_input_video: str, fov: int) -> str:
+        """
+        Finds the first hardware encoder that can convert the first frame of the input video.
+        The frame is converted at the size of the video, as hardware encoders are limited in resolution.
+
+        Args:
+            path_to_input_video (str): Path to the input video
+            fov (int): Field of view
+
+        Returns:
+            str: Name of the encoder, libx265 if no hardware encoder works
+        """
+
+        for encoder, encoder_settings in ENCODERS.items():
+            if encoder == "libx265":
+                continue
+            command = [
+                "ffmpeg",
+                "-v",
+                "error",
+                *encoder_settings["input_args"],
+                "-i",
+                path_to_input_video,
+                "-frames:v",
+                "1",
+                "-an",
+                "-filter:v",
+                self.__get_video_filter(fov, encoder_settings),
+                *self.__get_output_args(encoder_settings, 1),
+                "-f",
+                "null",
+                "-",
+            ]
+            if await self.__run_command(command) == 0:
+                return encoder
+        return "libx265"
+
+    async def __merge_chunks(self, conversion_data: ConversionData):
         """
         Merges converted chunks into one video file
+
+        Args:
+            conversion_data (ConversionData): Loaded conversion data
         """
 
         self.__update_status(
@@ -303,44 +780,75 @@ class Converter:
         )
 
         # merging chunks
-        with shelve.open(self.path_to_db) as db:
-            chunks_all = db["chunks_all"]
-            self.video_name = db["video_name"]
-            video_name_without_extension = self.__get_name_without_extension(
-                self.video_name
-            )
+        chunks_count = conversion_data["chunks_count"]
+        self.video_name = conversion_data["video_name"]
+        video_name_without_extension = self.__get_name_without_extension(
+            self.video_name
+        )
 
-        # creating txt file for ffmpeg
-        concat_file_path = self.__get_full_path("chunks.txt")
-        with open(concat_file_path, "w") as f:
-            for chunk in reversed(chunks_all):
-                f.write(f"file '{self.__get_name_without_extension(chunk)}_conv.mp4'\n")
+        # piping the bytes of all chunks to ffmpeg, which only rewraps them into mp4.
+        # The mp4 muxer converts the ADTS AAC audio of the chunks by itself.
+        chunk_paths = [
+            self.__get_full_path(f"{chunk_number}_conv.ts")
+            for chunk_number in range(chunks_count)
+        ]
         output_file_path = self.__get_full_path(
             f"{video_name_without_extension}_converted.mp4"
         )
         self.__remove_file(output_file_path)
-        command = f'ffmpeg -f concat -safe 0 -i "{concat_file_path}" -c copy "{output_file_path}"'
-        self.__run_command(command)
+        command = [
+            "ffmpeg",
+            "-f",
+            "mpegts",
+            "-i",
+            "pipe:0",
+            "-map",
+            "0",
+            "-c",
+            "copy",
+            output_file_path,
+        ]
+        if await self.__run_command(command, input_paths=chunk_paths) != 0:
+            raise RuntimeError("ffmpeg failed to merge the converted chunks")
 
         # deleting files after merging
         self.__update_status("CLEAN_UP", "Removing chunk files")
-        for chunk in chunks_all:
-            os.remove(
-                self.__get_full_path(
-                    f"{self.__get_name_without_extension(chunk)}_conv.mp4"
-                )
-            )
-        os.remove(concat_file_path)
+        for chunk_path in chunk_paths:
+            os.remove(chunk_path)
+
+    def __load_conversion_data(self) -> ConversionData:
+        """
+        Loads the conversion data file
+
+        Returns:
+            ConversionData: Conversion data saved in the conversion directory
+        """
+
+        with open(self.path_to_conversion_data) as f:
+            return json.load(f)
+
+    def __save_conversion_data(self, conversion_data: ConversionData):
+        """
+        Saves the conversion data file. The data is written to a temporary file first
+        and then renamed, so an interruption never leaves a half written file behind.
+
+        Args:
+            conversion_data (ConversionData): Conversion data to save
+        """
+
+        temporary_path = self.path_to_conversion_data + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(conversion_data, f)
+        os.replace(temporary_path, self.path_to_conversion_data)
 
-    def __delete_database(self):
+    def __delete_conversion_data(self):
         """
-        Deletes the database files
+        Deletes the conversion data file
         """
 
-        self.__update_status("CLEAN_UP", "Removing conversion data files")
+        self.__update_status("CLEAN_UP", "Removing conversion data file")
 
-        for filename in glob.glob(self.path_to_db + "*"):
-            os.remove(filename)
+        os.remove(self.path_to_conversion_data)
 
     def __get_full_path(self, filename: str) -> str:
         """
@@ -353,7 +861,8 @@ class Converter:
             str: Full path to the file
         """
 
-        return os.path.join(self.path_to_conversion_dir, filename)
+        # the directory ends with a separator, so the name is only appended
+        return self.conversion_dir_prefix + filename
 
     def __get_name_without_extension(self, path: str) -> str:
         """
@@ -366,32 +875,246 @@ class Converter:
             str: Name of the file without extension
         """
 
-        return os.path.basename(path).split(".")[0]
+        return os.path.splitext(os.path.basename(path))[0]
+
+    async def __run_command(
+        self,
+        command: List[str],
+        progress_callback: Optional[Callable[[Dict[str, str]], None]] = None,
+        input_paths: Optional[List[str]] = None,
+    ) -> int:
+        """
+        Runs a subbprocess with some default settings and waits for it without blocking the event loop.
+        The subprocess is terminated if the waiting task is cancelled.
+
+        Args:
+            command (List[str]): Command to run, the program followed by its arguments
+            progress_callback (Callable[[Dict[str, str]], None], optional): Function called with each block of progress
+            values the subprocess writes to stdout, the command must include FFMPEG_PROGRESS_ARGS
+            input_paths (List[str], optional): Files written one after another to stdin of the subprocess
+
+        Returns:
+            int: Return code of the subprocess
+        """
+
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=(
+                asyncio.subprocess.DEVNULL
+                if progress_callback is None
+                else asyncio.subprocess.PIPE
+            ),
+            stdin=(
+                asyncio.subprocess.DEVNULL
+                if input_paths is None
+                else asyncio.subprocess.PIPE
+            ),
+            stderr=asyncio.subprocess.DEVNULL,
+            creationflags=SUBPROCESS_CREATION_FLAGS,
+        )
+        with self.current_process_ids_lock:
+            self.current_process_ids.add(process.pid)
+        try:
+            if input_paths is not None:
+                for input_path in input_paths:
+                    with open(input_path, "rb") as f:
+                        while data := f.read(COPY_BUFFER_SIZE):
+                            process.stdin.write(data)
+                            await process.stdin.drain()
+                process.stdin.close()
+                await process.stdin.wait_closed()
+            if progress_callback is not None:
+                # ffmpeg writes blocks of key=value lines, each block ends with the progress key
+                progress = {}
+                async for line in process.stdout:
+                    key, _, value = line.decode(errors="replace").strip().partition("=")
+                    progress[key] = value
+                    if key == "progress":
+                        progress_callback(progress)
+                        progress = {}
+            return await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), PROCESS_EXIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+            raise
+        finally:
+            with self.current_process_ids_lock:
+                self.current_process_ids.discard(process.pid)
+
+    def __get_video_filter(self, fov: int, encoder_settings: dict) -> str:
+        """
+        Returns the filter reprojecting side-by-side fisheye video to equirectangular video
+
+        Args:
+            fov (int): Field of view
+            encoder_settings (dict): Settings of the encoder, one of the ENCODERS values
+
+        Returns:
+            str: ffmpeg video filter
+        """
+
+        return f"v360=input=fisheye:ih_fov={fov}:iv_fov={fov}:output=hequirect:in_stereo=sbs:out_stereo=sbs{encoder_settings['filter_suffix']}"
+
+    def __get_output_args(self, encoder_settings: dict, threads: int) -> List[str]:
+        """
+        Returns the output arguments of an encoder with the number of encoding threads filled in
+
+        Args:
+            encoder_settings (dict): Settings of the encoder, one of the ENCODERS values
+            threads (int): Number of encoding threads
+
+        Returns:
+            List[str]: ffmpeg output arguments
+        """
+
+        return [arg.format(threads=threads) for arg in encoder_settings["output_args"]]
+
+    def __get_progress_time(self, progress: Dict[str, str]) -> Optional[float]:
+        """
+        Returns the time of the processed video from a block of ffmpeg progress values
+
+        Args:
+            progress (Dict[str, str]): Block of progress values written by ffmpeg
+
+        Returns:
+            float: Processed time in seconds, None if ffmpeg has not reported it yet
+        """
+
+        out_time_us = progress.get("out_time_us", "N/A")
+        if not out_time_us.isdigit():
+            return None
+        return int(out_time_us) / 1_000_000
+
+    def __get_video_duration(self, path_to_video: str) -> float:
+        """
+        Returns the duration of a video using ffprobe
+
+        Args:
+            path_to_video (str): Path to the video
+
+        Returns:
+            float: Duration of the video in seconds
+        """
+
+        command = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path_to_video,
+        ]
+        result = subprocess.run(
+            command,
+            capture_output=True,
+            text=True,
+            check=True,
+            shell=False,
+            creationflags=SUBPROCESS_CREATION_FLAGS,
+        )
+        return float(result.stdout.strip())
 
-    def __run_command(self, command: str):
+    def __get_video_codec(self, path_to_video: str) -> str:
         """
-        Runs a subbprocess with some default settings
+        Returns the codec of the first video stream of a video using ffprobe
 
         Args:
-            command (str): Command to run
+            path_to_video (str): Path to the video
+
+        Returns:
+            str: Name of the codec used by ffmpeg
         """
 
-        self.current_process = subprocess.Popen(
+        command = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=codec_name",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path_to_video,
+        ]
+        result = subprocess.run(
             command,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            # check=True,
+            capture_output=True,
+            text=True,
+            check=True,
             shell=False,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-            | subprocess.CREATE_NO_WINDOW,
+            creationflags=SUBPROCESS_CREATION_FLAGS,
         )
-        self.current_process.wait()
+        return result.stdout.strip()
 
     def __cleanup(self):
         """
-        Stops the current subprocess
+        Stops the running subprocesses when the interpreter exits. Processes still running
+        after PROCESS_EXIT_TIMEOUT are killed. Only process ids are used here, because the
+        event loop owning the processes may be blocked in a callback of the conversion thread.
         """
-        self.current_process.terminate()
+
+        with self.current_process_ids_lock:
+            process_ids = list(self.current_process_ids)
+        if not process_ids:
+            return
+
+        for process_id in process_ids:
+            self.__send_signal(process_id, signal.SIGTERM)
+        # On Windows SIGTERM terminates the process right away, so there is nothing to wait for
+        if os.name == "nt":
+            return
+
+        deadline = time.monotonic() + PROCESS_EXIT_TIMEOUT
+        while process_ids and time.monotonic() < deadline:
+            time.sleep(0.05)
+            process_ids = [
+                process_id
+                for process_id in process_ids
+                if self.__is_process_running(process_id)
+            ]
+        for process_id in process_ids:
+            self.__send_signal(process_id, signal.SIGKILL)
+
+    def __send_signal(self, process_id: int, signal_number: int):
+        """
+        Sends a signal to a process, ignoring processes that have already exited
+
+        Args:
+            process_id (int): Id of the process
+            signal_number (int): Signal to send
+        """
+
+        try:
+            os.kill(process_id, signal_number)
+        except OSError:
+            pass
+
+    def __is_process_running(self, process_id: int) -> bool:
+        """
+        Checks if a child process is still running. Exited processes are reaped here, so
+        a process is not kept alive as a zombie when the event loop cannot reap it.
+
+        Args:
+            process_id (int): Id of the child process
+
+        Returns:
+            bool: True if the process is still running, False otherwise
+        """
+
+        try:
+            finished_process_id, _ = os.waitpid(process_id, os.WNOHANG)
+        except ChildProcessError:
+            # the process has already been reaped by the event loop
+            return False
+        return finished_process_id == 0
 
     def __remove_file(self, path: str):
         """
@@ -401,22 +1124,32 @@ class Converter:
             path (str): Path to the file
         """
 
-        if os.path.exists(path):
+        # removing straight away, checking if the file exists first would cost an extra call
+        try:
             os.remove(path)
+        except FileNotFoundError:
+            pass
 
     def __update_status(
         self,
         current_process: Literal[
-            "INITIALIZING", "CONVERTING_CHUNKS", "MERGING", "CLEAN_UP", "FINISHED"
+            "INITIALIZING",
+            "CONVERTING_CHUNKS",
+            "CONVERTING",
+            "MERGING",
+            "CLEAN_UP",
+            "FINISHED",
         ],
         message: str = "",
+        completion: float = 0,
     ):
         """
         Calculates the completion percentage and runs the callback with the updated status data.
 
         Args:
-            curent_process (Literal["INITIALIZING", "CONVERTING_CHUNKS", "MERGING", "CLEAN_UP", "FINISHED"]): Current process of the conversion
+            curent_process (Literal["INITIALIZING", "CONVERTING_CHUNKS", "CONVERTING", "MERGING", "CLEAN_UP", "FINISHED"]): Current process of the conversion
             message (str): Message including details about the current process
+            completion (float): Completion of the converting step from 0 to 1, used by CONVERTING_CHUNKS and CONVERTING
         """
 
         current_time = datetime.datetime.now()
@@ -432,22 +1165,25 @@ class Converter:
             }
             self.callback(status_data)
         elif current_process == "CONVERTING_CHUNKS":
-            with shelve.open(self.path_to_db) as db:
-                chunks_all_length = len(db["chunks_all"])
-                chunks_to_convert_length = len(db["chunks_to_convert"])
-            merging_completion = (
-                chunks_all_length - chunks_to_convert_length
-            ) / chunks_all_length
-            total_completion = 1 + round(merging_completion * 97)
             status_data = {
                 "video_name": self.video_name,
                 "fov": self.fov,
-                "completion_percentage": total_completion,
+                "completion_percentage": 1 + round(completion * 97),
                 "current_process": "CONVERTING_CHUNKS",
                 "message": message,
                 "timestamp": current_time,
             }
             self.callback(status_data)
+        elif current_process == "CONVERTING":
+            status_data = {
+                "video_name": self.video_name,
+                "fov": self.fov,
+                "completion_percentage": 1 + round(completion * 98),
+                "current_process": "CONVERTING",
+                "message": message,
+                "timestamp": current_time,
+            }
+            self.callback(status_data)
         elif current_process == "MERGING":
             status_data = {
                 "video_name": self.video_name,
@@ -492,9 +1228,12 @@ if __name__ == "__main__":
             f"{formatted_timestamp} - completion: {data['completion_percentage']}% status: {data['current_process']} - {data['message']}"
         )
 
-    def new_conversion_handler():
+    def new_conversion_handler(resumable: bool = True):
         """
         Asks the user for necessary information and starts a new conversion process
+
+        Args:
+            resumable (bool): Whether to run the chunked conversion that can be continued after an interruption
         """
 
         # Initializing the converter
@@ -532,7 +1271,12 @@ if __name__ == "__main__":
         print("")
         print("STARTING NEW CONVERSION")
         print("")
-        converter.new_conversion(path_to_input_video, path_to_output, fov_int)
+        if resumable:
+            converter.new_conversion(path_to_input_video, path_to_output, fov_int)
+        else:
+            converter.new_conversion_oneshot(
+                path_to_input_video, path_to_output, fov_int
+            )
 
     def continue_conversion_handler():
         """
@@ -569,9 +1313,10 @@ if __name__ == "__main__":
         print("AVIABLE ACTIONS:")
         print("1 - Start a new conversion")
         print("2 - Continue a conversion")
+        print("3 - Start a new single pass conversion (faster, cannot be continued)")
         print("")
         action = input("Enter the number of the action you want to perform: ").strip()
-        while action not in ["1", "2"]:
+        while action not in ["1", "2", "3"]:
             print("Invalid action")
             action = input(
                 "Enter the number of the action you want to perform: "
@@ -583,5 +1328,7 @@ if __name__ == "__main__":
             new_conversion_handler()
         elif action == "2":
             continue_conversion_handler()
+        elif action == "3":
+            new_conversion_handler(resumable=False)
 
     main()